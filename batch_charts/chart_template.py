@@ -0,0 +1,171 @@
+# encoding=utf-8
+import math
+import os
+
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+
+from config import app_logger
+
+
+def value_level_text(value_level):
+    """销量价值等级对应的显示文字"""
+    if value_level == 1:
+        return '10日销售额：极低值'
+    elif value_level == 2:
+        return '10日销售额：低值'
+    elif value_level == 3:
+        return '10日销售额：中等值'
+    elif value_level == 4:
+        return '10日销售额：高值'
+    elif value_level == 5:
+        return '10日销售额：极高值'
+    else:
+        return '10日销售额：未知'
+
+
+def prepare_chart_data(sales_info, result):
+    """根据analyze_sales_data的结果截取日期范围，并计算画图所需的累计销量"""
+    sales_df = sales_info['销量数据']
+    df = sales_df[(sales_df['操作日期'] >= result['起始日期']) & (sales_df['操作日期'] <= result['结束日期'])].copy()
+    for window in (5, 7, 10):
+        df[f'近{window}日累计销量'] = df['当日销量'].rolling(window=window, min_periods=1).sum()
+    return df
+
+
+def _create_axes_template(ax):
+    """在坐标轴上创建一次所有图元，之后每个药品只更新数据"""
+    artists = {
+        '坐标轴': ax,
+        '日结库存': ax.stairs([0], [0, 1], fill=True, color='lightblue', label='日结库存'),
+        '当日销量': ax.plot([], [], color='red', label='当日销量')[0],
+        '短周期累计销量': ax.plot([], [], color='blue')[0],
+        '长周期累计销量': ax.plot([], [], color='green')[0],
+        '拟设下限': ax.axhline(y=0, color='blue', linestyle='--'),
+        '拟设上限': ax.axhline(y=0, color='green', linestyle='--'),
+        '下限文字': ax.text(0, 0, '', ha='left', va='center'),
+        '上限文字': ax.text(0, 0, '', ha='left', va='center'),
+        '等级文字': ax.text(0, 0, '', ha='left', va='center'),
+        '图例周期': None,
+    }
+    ax.set_xlabel('日期')
+    ax.set_ylabel('数量')
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
+    ax.tick_params(axis='x', labelrotation=45)
+    return artists
+
+
+def create_chart_template(rows=1, cols=1):
+    """
+    创建可复用的图表模板
+    :param rows: 每页行数
+    :param cols: 每页列数
+    :return: {'图': figure, '坐标轴模板': 各坐标轴的图元}
+    """
+    # 设置matplotlib字体为通用字体，只需设置一次
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
+
+    figsize = (20, 10) if rows * cols == 1 else (10 * cols, 5 * rows)
+    fig, axes = plt.subplots(rows, cols, figsize=figsize, squeeze=False)
+    fig.subplots_adjust(left=0.06, right=0.92, bottom=0.1, top=0.94, hspace=0.6, wspace=0.25)
+    return {'图': fig, '坐标轴模板': [_create_axes_template(ax) for ax in axes.flat]}
+
+
+def update_chart(artists, df, drug_name, drug_spec, unit, value_level, upper_limit, lower_limit):
+    """将单个药品的数据写入已有图元"""
+    ax = artists['坐标轴']
+    ax.set_visible(True)
+    x = mdates.date2num(df['操作日期'].to_numpy())
+    edges = np.append(x - 0.5, x[-1] + 0.5)
+
+    artists['日结库存'].set_data(df['日结库存'].fillna(0).to_numpy(), edges)
+    artists['当日销量'].set_data(x, df['当日销量'])
+
+    # 极高值药品按近5日、近7日累计销量设置上下限，其余按近7日、近10日
+    periods = (5, 7) if value_level == 5 else (7, 10)
+    artists['短周期累计销量'].set_data(x, df[f'近{periods[0]}日累计销量'])
+    artists['长周期累计销量'].set_data(x, df[f'近{periods[1]}日累计销量'])
+    if artists['图例周期'] != periods:
+        artists['短周期累计销量'].set_label(f'近{periods[0]}日累计销量')
+        artists['长周期累计销量'].set_label(f'近{periods[1]}日累计销量')
+        ax.legend(loc='upper left')
+        artists['图例周期'] = periods
+
+    artists['拟设下限'].set_ydata([lower_limit, lower_limit])
+    artists['拟设上限'].set_ydata([upper_limit, upper_limit])
+    artists['下限文字'].set_position((x[-1], lower_limit * 0.95))
+    artists['下限文字'].set_text(f'拟设下限：{lower_limit:.2f}')
+    artists['上限文字'].set_position((x[-1], upper_limit * 1.05))
+    artists['上限文字'].set_text(f'拟设上限：{upper_limit:.2f}')
+    artists['等级文字'].set_position((x[-1], (upper_limit + lower_limit) / 2))
+    artists['等级文字'].set_text(value_level_text(value_level))
+
+    ax.set_title(f'{drug_name} {drug_spec}库存与销量分析（单位：{unit}）')
+    ax.relim()
+    ax.autoscale_view()
+
+
+def render_batch_report(charts, export_file, rows=1, cols=1):
+    """
+    使用同一个图表模板批量绘制多个药品，导出为一个多页PDF或若干张多图拼版PNG
+    逐页绘制、写入，charts可以是生成器，内存中只保留当前一页的数据
+    :param charts: 可迭代的(prepare_chart_data返回的数据, analyze_sales_data的结果)
+    :param export_file: 导出文件，.pdf为多页报告，其他后缀按页导出PNG
+    :param rows: 每页行数
+    :param cols: 每页列数
+    :return: 导出的文件列表
+    """
+    os.makedirs(os.path.dirname(export_file) or '.', exist_ok=True)
+    template = create_chart_template(rows, cols)
+    axes_templates = template['坐标轴模板']
+    per_page = rows * cols
+    is_pdf = export_file.lower().endswith('.pdf')
+    base_name, extension = os.path.splitext(export_file)
+    pdf = PdfPages(export_file) if is_pdf else None
+    exported = []
+    count = 0
+
+    def save_page(page_size):
+        # 最后一页不足时隐藏多余的坐标轴
+        for artists in axes_templates[page_size:]:
+            artists['坐标轴'].set_visible(False)
+        if is_pdf:
+            pdf.savefig(template['图'])
+        else:
+            page_file = f'{base_name}_{len(exported) + 1}{extension or ".png"}'
+            template['图'].savefig(page_file)
+            exported.append(page_file)
+
+    try:
+        for df, result in charts:
+            if df is None or df.empty:
+                continue
+            update_chart(axes_templates[count % per_page], df, result['药品名称'], result['规格'], result['单位'],
+                         result['销量价值等级'], result['拟设上限'], result['拟设下限'])
+            count += 1
+            if count % per_page == 0:
+                save_page(per_page)
+        if count % per_page:
+            save_page(count % per_page)
+    finally:
+        if pdf is not None:
+            pdf.close()
+        plt.close(template['图'])
+
+    if count == 0:
+        app_logger.warning("没有需要绘制的图表")
+        return []
+
+    pages = math.ceil(count / per_page)
+    if is_pdf:
+        exported = [export_file]
+    elif pages == 1:
+        # 只有一页时沿用导出文件名，不加页码
+        os.replace(exported[0], export_file)
+        exported = [export_file]
+    app_logger.info(f"批量绘图完成: {count}个药品，{pages}页，导出到 {export_file}")
+    return exported
@@ -0,0 +1,21 @@
+# encoding=utf-8
+import os
+
+from batch_charts.chart_template import prepare_chart_data, render_batch_report
+from config import export_path
+from extract_data.daily_series_store import open_daily_series_store, load_sales_info
+from upper_and_lower_limits.calculate_upper_and_lower_limits import analyze_sales_data
+
+
+if __name__ == '__main__':
+    # 从共享存储读取销量数据，分析后导出为一个多页PDF报告
+    store = open_daily_series_store()
+
+    def iter_charts():
+        for row in range(len(store['药品索引'])):
+            sales_info = load_sales_info(store, row)
+            result = analyze_sales_data(sales_info, export_graph=False)
+            if result:
+                yield prepare_chart_data(sales_info, result), result
+
+    render_batch_report(iter_charts(), os.path.join(export_path, '库存与销量分析.pdf'))
@@ -4,6 +4,23 @@ import loguru
 directory_path = r'D:\药事\5.降低静配中心药品供应短缺率\消耗记录'
 export_path = r'D:\药事\5.降低静配中心药品供应短缺率\汇总记录'
 
+# 多站点出入库明细目录（站点名称: 目录），各站点的缓存相互独立
+site_directory_paths = {
+    '静配中心': directory_path,
+}
+
+# 日序列共享存储路径（内存映射，供多进程分析直接读取）
+daily_series_store_path = os.path.join(export_path, 'daily_series_store')
+
+# 基准结果路径（用于校验各执行模式的结果一致性）
+golden_path = os.path.join(export_path, 'golden')
+
+# 账目校验隔离清单路径（未通过校验的文件，分析时跳过）
+quarantine_file_path = os.path.join(export_path, 'quarantine.json')
+
+# 断点续跑日志路径
+checkpoint_path = os.path.join(export_path, 'checkpoints')
+
 # 设置日志文件路径
 app_log_path = os.path.join(os.path.dirname(__file__), "log/app.log")
 error_log_path = os.path.join(os.path.dirname(__file__), "log/errors.log")
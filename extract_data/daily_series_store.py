@@ -0,0 +1,189 @@
+# encoding=utf-8
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import directory_path, daily_series_store_path, app_logger, error_logger
+from extract_data.extract_sales_data import extract_sales_data
+from utils import list_excel_files
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+# 存储中的矩阵列（药品 × 日期），缺失日期以NaN填充
+SERIES_COLUMNS = ['当日销量', '日结库存']
+DATES_FILE = 'dates.npy'
+INDEX_FILE = 'drug_index.json'
+BASIC_INFO_COLUMNS = ['自定义码', '药品名称', '规格', '单位', '入出库数量', '购入金额']
+# 打开存储时遇到正在替换的短暂空档，最多重试的次数及间隔（秒）
+OPEN_RETRIES = 5
+OPEN_RETRY_INTERVAL = 0.2
+
+
+def _to_builtin(value):
+    """将numpy/pandas标量转换为可JSON序列化的python对象"""
+    if pd.isna(value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def build_daily_series_store(sales_data, store_path=daily_series_store_path):
+    """
+    将extract_sales_data的结果写入内存映射的(药品 × 日期)矩阵
+    :param sales_data: extract_sales_data返回结果的列表
+    :param store_path: 存储目录
+    :return: 写入的药品数量
+    """
+    sales_data = [info for info in sales_data if info]
+    if not sales_data:
+        app_logger.warning("没有可写入共享存储的销量数据")
+        return 0
+
+    # 先写入同级临时目录，全部写完后再整体替换，正在读取旧存储的进程不会读到写了一半的数据
+    store_path = os.path.abspath(store_path)
+    temp_path = f'{store_path}.tmp{os.getpid()}'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    try:
+        count = _write_store(sales_data, temp_path)
+        _swap_store(temp_path, store_path)
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    app_logger.info(f"共享存储写入完成: {count}个药品，路径: {store_path}")
+    return count
+
+
+def _swap_store(temp_path, store_path):
+    """
+    用os.replace将临时目录替换为正式存储目录，旧目录在替换后删除
+    两次os.replace之间存储目录短暂不存在，open_daily_series_store遇到时会稍后重试
+    """
+    old_path = f'{store_path}.old{os.getpid()}'
+    if os.path.exists(store_path):
+        try:
+            os.replace(store_path, old_path)
+        except PermissionError:
+            # Windows下旧存储仍被其他进程映射时无法改名，此时保持旧存储不变
+            error_logger.error(f"共享存储 {store_path} 正在被其他进程使用，本次未替换，请关闭相关进程后重试")
+            raise
+    os.replace(temp_path, store_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def _write_store(sales_data, store_path):
+    """将矩阵、日期及药品索引写入指定目录，药品索引最后写入"""
+    # 以所有药品的最早、最晚日期构造统一日历
+    first_date = min(info['销量数据']['操作日期'].min() for info in sales_data)
+    last_date = max(info['销量数据']['操作日期'].max() for info in sales_data)
+    dates = np.arange(np.datetime64(first_date, 'D'), np.datetime64(last_date, 'D') + 1)
+    np.save(os.path.join(store_path, DATES_FILE), dates)
+
+    # 逐行写入矩阵，避免一次性在内存中构造整张表
+    matrices = {column: np.lib.format.open_memmap(os.path.join(store_path, f'{column}.npy'), mode='w+',
+                                                  dtype=np.float64, shape=(len(sales_data), len(dates)))
+                for column in SERIES_COLUMNS}
+    for matrix in matrices.values():
+        matrix[:] = np.nan
+
+    drug_index = []
+    for row, info in enumerate(sales_data):
+        sales_df = info['销量数据']
+        offsets = (pd.to_datetime(sales_df['操作日期']).values.astype('datetime64[D]') - dates[0]).astype(np.int64)
+        for column in SERIES_COLUMNS:
+            matrices[column][row, offsets] = sales_df[column].to_numpy(dtype=np.float64)
+
+        basic_info = info['药品基本信息']
+        record = {column: _to_builtin(basic_info.get(column)) for column in BASIC_INFO_COLUMNS}
+        record.update({'文件名': info['文件名'], '起始偏移': int(offsets.min()), '结束偏移': int(offsets.max()) + 1})
+        drug_index.append(record)
+
+    for matrix in matrices.values():
+        matrix.flush()
+    del matrices
+
+    with open(os.path.join(store_path, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(drug_index, f, ensure_ascii=False, indent=2)
+    return len(drug_index)
+
+
+def open_daily_series_store(store_path=daily_series_store_path):
+    """
+    以只读内存映射方式打开共享存储，各进程打开后直接按行切片，无需序列化
+    :param store_path: 存储目录
+    :return: {'日期': 日期数组, '药品索引': 药品信息列表, '当日销量': 矩阵, '日结库存': 矩阵}
+    """
+    for attempt in range(OPEN_RETRIES):
+        try:
+            with open(os.path.join(store_path, INDEX_FILE), encoding='utf-8') as f:
+                drug_index = json.load(f)
+
+            store = {'日期': np.load(os.path.join(store_path, DATES_FILE)), '药品索引': drug_index}
+            for column in SERIES_COLUMNS:
+                store[column] = np.load(os.path.join(store_path, f'{column}.npy'), mmap_mode='r')
+            return store
+        except FileNotFoundError:
+            # 存储不存在，或其他进程正在替换存储（见_swap_store），稍后重试，仍不存在时抛出
+            if attempt == OPEN_RETRIES - 1:
+                raise
+            time.sleep(OPEN_RETRY_INTERVAL)
+
+
+def find_drug_row(store, file_name=None, drug_code=None):
+    """按文件名或自定义码查找药品所在行，找不到时返回None"""
+    for row, record in enumerate(store['药品索引']):
+        if file_name is not None and record['文件名'] == file_name:
+            return row
+        if drug_code is not None and str(record['自定义码']) == str(drug_code):
+            return row
+    return None
+
+
+def get_drug_series(store, row):
+    """
+    获取单个药品的日期及各列序列，返回的是内存映射上的切片视图（零拷贝）
+    :param store: open_daily_series_store的返回值
+    :param row: 药品所在行
+    :return: (日期数组, {列名: 序列})
+    """
+    record = store['药品索引'][row]
+    start, end = record['起始偏移'], record['结束偏移']
+    return store['日期'][start:end], {column: store[column][row, start:end] for column in SERIES_COLUMNS}
+
+
+def load_sales_info(store, row):
+    """
+    将共享存储中的一行还原为extract_sales_data的返回格式，可直接传给analyze_sales_data、calculate_shortage_rate
+    :param store: open_daily_series_store的返回值
+    :param row: 药品所在行
+    :return: {'文件名': 文件名, '药品基本信息': 基本信息, '销量数据': 日销量数据}
+    """
+    record = store['药品索引'][row]
+    dates, series = get_drug_series(store, row)
+
+    sales_df = pd.DataFrame({'操作日期': pd.to_datetime(dates).date})
+    sales_df['当日销量'] = series['当日销量']
+    sales_df['日结库存'] = series['日结库存']
+    basic_info = pd.Series({column: record[column] for column in BASIC_INFO_COLUMNS})
+    return {'文件名': record['文件名'], '药品基本信息': basic_info, '销量数据': sales_df}
+
+
+if __name__ == '__main__':
+    # 提取销量数据并写入共享存储
+    sales_data = []
+    for filename in list_excel_files(directory_path):
+        file_path = os.path.join(directory_path, filename)
+        try:
+            result = extract_sales_data(file_path)
+            if result:
+                sales_data.append(result)
+        except Exception as e:
+            error_logger.error(f"处理文件 {filename} 时发生错误: {e}")
+
+    build_daily_series_store(sales_data)
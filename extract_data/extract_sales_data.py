@@ -60,6 +60,18 @@ def extract_sales_data(file_path, start_date=None, end_date=None):
     if df is None:
         return None
 
+    return extract_sales_data_from_df(df, file_name, start_date, end_date)
+
+
+def extract_sales_data_from_df(df, file_name, start_date=None, end_date=None):
+    """
+    从已读取的出入库明细中提取销量信息
+    :param df: 出入库明细
+    :param file_name: 文件名
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :return: 销量信息
+    """
     basic_info = extract_basic_info(df)
     df = filter_and_transform(df)
 
@@ -0,0 +1,142 @@
+# encoding=utf-8
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import daily_series_store_path, app_logger
+from extract_data.daily_series_store import open_daily_series_store
+from utils import parse_date
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+# 前缀和矩阵（药品 × (日期+1)），第0列为0，区间[i, j)的和为 P[:, j] - P[:, i]
+CUBE_COLUMNS = ['累计天数', '累计销量', '累计销量平方', '累计短缺天数', '累计在售天数', '累计0销量天数', '累计库存', '累计库存天数']
+
+
+def _prefix_sum(matrix):
+    prefix = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype=np.float64)
+    np.cumsum(matrix, axis=1, dtype=np.float64, out=prefix[:, 1:])
+    return prefix
+
+
+def build_sales_cube(store):
+    """
+    根据共享存储构造各药品的前缀和，之后任意日期区间的汇总指标均可O(1)得到
+    :param store: open_daily_series_store的返回值
+    :return: {'日期': 日期数组, '起始偏移': 数组, '结束偏移': 数组, 各前缀和矩阵}
+    """
+    sales = np.asarray(store['当日销量'])
+    stock = np.asarray(store['日结库存'])
+    valid = ~np.isnan(sales)
+    stock_valid = valid & ~np.isnan(stock)
+    filled_sales = np.where(valid, sales, 0)
+
+    # 与calculate_shortage_rate、analyze_sales_data的口径一致
+    with np.errstate(invalid='ignore'):
+        shortage = valid & (stock < sales)
+    in_sale = valid & ((sales != 0) | (stock != 0))
+
+    cube = {
+        '日期': store['日期'],
+        '起始偏移': np.array([record['起始偏移'] for record in store['药品索引']], dtype=np.int64),
+        '结束偏移': np.array([record['结束偏移'] for record in store['药品索引']], dtype=np.int64),
+        '累计天数': _prefix_sum(valid),
+        '累计销量': _prefix_sum(filled_sales),
+        '累计销量平方': _prefix_sum(filled_sales ** 2),
+        '累计短缺天数': _prefix_sum(shortage),
+        '累计在售天数': _prefix_sum(in_sale),
+        '累计0销量天数': _prefix_sum(valid & (filled_sales == 0)),
+        '累计库存': _prefix_sum(np.where(stock_valid, stock, 0)),
+        '累计库存天数': _prefix_sum(stock_valid),
+    }
+    app_logger.info(f"前缀和构造完成: {sales.shape[0]}个药品，{sales.shape[1]}天")
+    return cube
+
+
+def save_sales_cube(cube, store_path=daily_series_store_path):
+    """将前缀和保存到共享存储目录，先写临时文件再替换，不影响正在读取的进程"""
+    for column in CUBE_COLUMNS:
+        cube_file = os.path.join(store_path, f'cube_{column}.npy')
+        temp_file = f'{cube_file}.tmp{os.getpid()}.npy'
+        np.save(temp_file, cube[column])
+        os.replace(temp_file, cube_file)
+
+
+def open_sales_cube(store_path=daily_series_store_path):
+    """以内存映射方式打开已保存的前缀和"""
+    store = open_daily_series_store(store_path)
+    cube = {
+        '日期': store['日期'],
+        '起始偏移': np.array([record['起始偏移'] for record in store['药品索引']], dtype=np.int64),
+        '结束偏移': np.array([record['结束偏移'] for record in store['药品索引']], dtype=np.int64),
+    }
+    for column in CUBE_COLUMNS:
+        cube[column] = np.load(os.path.join(store_path, f'cube_{column}.npy'), mmap_mode='r')
+    return cube
+
+
+def query_sales_cube(cube, start_date=None, end_date=None, rows=None):
+    """
+    查询任意日期区间的短缺率、日均销量、相对标准差、0销量天数占比等指标
+    与filter_date_range一致，区间会截取到各药品自身的起止日期
+    :param cube: build_sales_cube或open_sales_cube的返回值
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param rows: 需要查询的药品行，为空时查询全部药品
+    :return: 指标表，每行一个药品
+    """
+    rows = np.arange(len(cube['起始偏移'])) if rows is None else np.asarray(rows)
+    dates = cube['日期']
+    one_day = np.timedelta64(1, 'D')
+    start_offset = (np.datetime64(parse_date(start_date), 'D') - dates[0]) // one_day if start_date else 0
+    end_offset = (np.datetime64(parse_date(end_date), 'D') - dates[0]) // one_day + 1 if end_date else len(dates)
+
+    low = np.maximum(cube['起始偏移'][rows], start_offset)
+    high = np.maximum(np.minimum(cube['结束偏移'][rows], end_offset), low)
+
+    def window_sum(column):
+        prefix = cube[column]
+        return prefix[rows, high] - prefix[rows, low]
+
+    days = window_sum('累计天数')
+    total_sales = window_sum('累计销量')
+    shortage_days = window_sum('累计短缺天数')
+    in_sale_days = window_sum('累计在售天数')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_avg_sales = total_sales / days
+        variance = (window_sum('累计销量平方') - total_sales ** 2 / days) / (days - 1)
+        relative_std = np.where(days > 1, np.sqrt(np.maximum(variance, 0)), np.nan) / daily_avg_sales
+        daily_avg_stock = window_sum('累计库存') / window_sum('累计库存天数')
+        days_of_stock = daily_avg_stock / daily_avg_sales
+        shortage_rate = shortage_days / in_sale_days
+        zero_sales_days_ratio = window_sum('累计0销量天数') / days
+
+    return pd.DataFrame({
+        '行号': rows,
+        '短缺天数': shortage_days.astype(np.int64),
+        '在售天数': in_sale_days.astype(np.int64),
+        '短缺率': shortage_rate,
+        '日均销量': daily_avg_sales,
+        '相对标准差': relative_std,
+        '日均库存': daily_avg_stock,
+        '库存天数': days_of_stock,
+        '0销量天数占比': zero_sales_days_ratio,
+        '统计天数': days.astype(np.int64),
+        '起始日期': pd.to_datetime(dates[0] + low).date,
+        '结束日期': pd.to_datetime(dates[0] + np.maximum(high - 1, low)).date,
+    })
+
+
+if __name__ == '__main__':
+    # 构造并保存前缀和，之后的区间查询无需再读取日序列
+    cube = build_sales_cube(open_daily_series_store(daily_series_store_path))
+    save_sales_cube(cube, daily_series_store_path)
+
+    # 示例：滑动查询每月的短缺率
+    for month_start in pd.date_range(start=pd.Timestamp(cube['日期'][0]), end=pd.Timestamp(cube['日期'][-1]), freq='MS'):
+        month_end = month_start + pd.offsets.MonthEnd(0)
+        report = query_sales_cube(cube, month_start.strftime('%Y-%m-%d'), month_end.strftime('%Y-%m-%d'))
+        app_logger.info(f"{month_start:%Y-%m} 平均短缺率: {report['短缺率'].mean():.4f}")
@@ -0,0 +1,226 @@
+# encoding=utf-8
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from config import directory_path, export_path, quarantine_file_path, app_logger, error_logger
+from utils import file_signature, list_excel_files, read_excel_file
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+REQUIRED_COLUMNS = ['自定义码', '药品名称', '规格', '单位', '类型', '入出库数量', '购入金额', '库存量', '操作日期']
+
+# 问题等级：隔离的文件不参与分析，警告仅记录
+QUARANTINE = '隔离'
+WARNING = '警告'
+PASSED = '通过'
+
+
+def _issue(file_name, level, issue_type, rows, description):
+    return {'文件名': file_name, '等级': level, '问题类型': issue_type,
+            '首个行号': int(rows[0]) if len(rows) else None, '行数': len(rows), '说明': description}
+
+
+def validate_ledger(df, file_name, max_break_ratio=0.01, outlier_threshold=10):
+    """
+    对单个药品的出入库明细做向量化校验
+    :param df: 出入库明细
+    :param file_name: 文件名
+    :param max_break_ratio: 库存不连续行数占比超过该值时隔离
+    :param outlier_threshold: 摆药数量的稳健Z分数超过该值时视为异常值
+    :return: 问题列表
+    """
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing_columns:
+        return [_issue(file_name, QUARANTINE, '缺少列', [], f"缺少列: {', '.join(missing_columns)}")]
+
+    issues = []
+    # 行号与Excel一致（标题行为第1行）
+    excel_rows = df.index.to_numpy() + 2
+
+    # 空值行在extract_sales_data中会被直接删除
+    empty_rows = df[['类型', '入出库数量', '库存量', '操作日期']].isna().any(axis=1).to_numpy()
+    if empty_rows.any():
+        issues.append(_issue(file_name, WARNING, '存在空值', excel_rows[empty_rows],
+                             f"{empty_rows.sum()}行关键列为空，分析时将被删除"))
+
+    # 同一文件中出现多个自定义码，说明存在换品种
+    codes = df['自定义码'].dropna().astype(str).unique()
+    if len(codes) > 1:
+        switched = (df['自定义码'].notna() & (df['自定义码'].astype(str) != codes[0])).to_numpy()
+        first_switch = excel_rows[switched]
+        issues.append(_issue(file_name, QUARANTINE, '自定义码不一致', first_switch,
+                             f"包含多个自定义码: {', '.join(codes)}"))
+
+    # 操作日期须单调不减，否则日结库存取值错误
+    dates = pd.to_datetime(df['操作日期'], errors='coerce')
+    invalid_dates = (dates.isna() & df['操作日期'].notna()).to_numpy()
+    if invalid_dates.any():
+        issues.append(_issue(file_name, QUARANTINE, '日期无法解析', excel_rows[invalid_dates],
+                             f"{invalid_dates.sum()}行操作日期无法解析"))
+    unsorted = (dates.diff() < pd.Timedelta(0)).to_numpy()
+    if unsorted.any():
+        issues.append(_issue(file_name, QUARANTINE, '日期未排序', excel_rows[unsorted],
+                             f"{unsorted.sum()}行操作日期早于上一行"))
+
+    # 库存量不应为负
+    stock = pd.to_numeric(df['库存量'], errors='coerce').to_numpy(dtype=np.float64)
+    quantity = pd.to_numeric(df['入出库数量'], errors='coerce').to_numpy(dtype=np.float64)
+    negative = stock < 0
+    if negative.any():
+        issues.append(_issue(file_name, QUARANTINE, '库存为负', excel_rows[negative],
+                             f"{negative.sum()}行库存量为负"))
+
+    # 库存连续性：上一行库存量 + 本行入出库数量 = 本行库存量
+    if len(stock) > 1:
+        with np.errstate(invalid='ignore'):
+            breaks = np.abs(stock[:-1] + quantity[1:] - stock[1:]) > 1e-6
+        breaks_rows = excel_rows[1:][breaks]
+        if len(breaks_rows):
+            ratio = len(breaks_rows) / (len(stock) - 1)
+            level = QUARANTINE if ratio > max_break_ratio else WARNING
+            issues.append(_issue(file_name, level, '库存不连续', breaks_rows,
+                                 f"{len(breaks_rows)}行库存与上一行不衔接，占比{ratio:.2%}"))
+
+    # 摆药数量异常值（基于中位数绝对偏差的稳健Z分数）
+    dispensing = (df['类型'] == '住院摆药').to_numpy() & ~np.isnan(quantity)
+    if dispensing.sum() > 10:
+        amounts = np.abs(quantity[dispensing])
+        median = np.median(amounts)
+        mad = np.median(np.abs(amounts - median))
+        if mad > 0:
+            outliers = 0.6745 * np.abs(amounts - median) / mad > outlier_threshold
+            if outliers.any():
+                issues.append(_issue(file_name, WARNING, '数量异常', excel_rows[dispensing][outliers],
+                                     f"{outliers.sum()}行摆药数量明显偏离中位数{median:g}"))
+
+    return issues
+
+
+def validate_file(file_path, max_break_ratio=0.01, outlier_threshold=10):
+    """
+    读取并校验单个文件（在子进程中执行）
+    :return: {'文件名': 文件名, '状态': 通过/警告/隔离, '问题': 问题列表, '文件签名': 校验时的文件签名}
+    """
+    file_name = os.path.basename(file_path)
+    # 读取前记录签名，读取期间文件被修改时签名不一致，下次会重新校验
+    signature = file_signature(file_path)
+    try:
+        df = read_excel_file(file_path)
+        if df is None:
+            issues = [_issue(file_name, QUARANTINE, '读取失败', [], "文件无法读取")]
+        else:
+            issues = validate_ledger(df, file_name, max_break_ratio, outlier_threshold)
+    except Exception as e:
+        error_logger.error(f"校验文件 {file_path} 时发生错误: {e}")
+        issues = [_issue(file_name, QUARANTINE, '校验出错', [], str(e))]
+
+    levels = {issue['等级'] for issue in issues}
+    status = QUARANTINE if QUARANTINE in levels else WARNING if WARNING in levels else PASSED
+    return {'文件名': file_name, '状态': status, '问题': issues, '文件签名': signature}
+
+
+def _validate_files(file_paths, max_workers=None, max_break_ratio=0.01, outlier_threshold=10):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(validate_file, file_paths, repeat(max_break_ratio), repeat(outlier_threshold)))
+
+
+def validate_directory(directory=directory_path, max_workers=None, max_break_ratio=0.01, outlier_threshold=10):
+    """
+    并行校验目录下的所有出入库明细，导出校验报告并更新隔离清单
+    :param directory: 出入库明细目录
+    :param max_workers: 最大进程数
+    :param max_break_ratio: 库存不连续行数占比超过该值时隔离
+    :param outlier_threshold: 摆药数量的稳健Z分数超过该值时视为异常值
+    :return: 各文件的校验结果
+    """
+    file_paths = [os.path.join(directory, filename) for filename in list_excel_files(directory)]
+    results = _validate_files(file_paths, max_workers, max_break_ratio, outlier_threshold)
+
+    summary = pd.DataFrame([{'文件名': result['文件名'], '状态': result['状态'], '问题数': len(result['问题'])}
+                            for result in results])
+    details = pd.DataFrame([issue for result in results for issue in result['问题']],
+                           columns=['文件名', '等级', '问题类型', '首个行号', '行数', '说明'])
+
+    os.makedirs(export_path, exist_ok=True)
+    export_xls_file = os.path.join(export_path, "账目校验报告.xlsx")
+    with pd.ExcelWriter(export_xls_file) as writer:
+        summary.to_excel(writer, sheet_name='汇总', index=False)
+        details.to_excel(writer, sheet_name='问题明细', index=False)
+
+    quarantined = [result['文件名'] for result in results if result['状态'] == QUARANTINE]
+    save_validation_results(directory, results, replace=True)
+
+    app_logger.info(f"账目校验完成: 共{len(results)}个文件，隔离{len(quarantined)}个，报告已导出到 {export_xls_file}")
+    return results
+
+
+def load_validation_results(directory, path=quarantine_file_path):
+    """
+    读取目录中各文件的校验结论
+    :return: {文件名: {'状态': 通过/警告/隔离, '文件签名': 校验时的文件签名}}，未校验过时返回空字典
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        verdicts = json.load(f).get(os.path.abspath(directory), {})
+    # 旧版隔离清单只记录了文件名，没有签名，视为未校验
+    return verdicts if isinstance(verdicts, dict) else {}
+
+
+def save_validation_results(directory, results, replace=False, path=quarantine_file_path):
+    """
+    按目录保存各文件的校验结论及文件签名，不影响其他目录的结论
+    :param directory: 出入库明细目录
+    :param results: validate_file的返回结果列表
+    :param replace: 为True时替换该目录的全部结论（整目录校验），否则只更新results中的文件
+    :param path: 隔离清单文件
+    """
+    quarantine = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            quarantine = json.load(f)
+    directory = os.path.abspath(directory)
+    verdicts = {} if replace else load_validation_results(directory, path)
+    verdicts.update({result['文件名']: {'状态': result['状态'], '文件签名': result['文件签名']} for result in results})
+    quarantine[directory] = dict(sorted(verdicts.items()))
+
+    # 先写临时文件再替换，避免中断时隔离清单损坏
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp{os.getpid()}'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(quarantine, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def refresh_quarantined_files(directory, file_names=None, max_workers=None, path=quarantine_file_path):
+    """
+    获取目录的隔离文件，未校验过或校验后文件有变化（签名不一致）的文件先重新校验
+    :param directory: 出入库明细目录
+    :param file_names: 需要检查的文件，为空时检查目录下的全部文件
+    :param max_workers: 最大进程数
+    :param path: 隔离清单文件
+    :return: 隔离的文件名集合
+    """
+    file_names = list_excel_files(directory) if file_names is None else file_names
+    verdicts = load_validation_results(directory, path)
+    stale_files = [filename for filename in file_names
+                   if verdicts.get(filename, {}).get('文件签名') != file_signature(os.path.join(directory, filename))]
+    if stale_files:
+        app_logger.info(f"{len(stale_files)}个文件未校验或已变化，重新校验")
+        results = _validate_files([os.path.join(directory, filename) for filename in stale_files], max_workers)
+        save_validation_results(directory, results, path=path)
+        verdicts.update({result['文件名']: result for result in results})
+    return {filename for filename in file_names if verdicts[filename]['状态'] == QUARANTINE}
+
+
+if __name__ == '__main__':
+    results = validate_directory(directory_path)
+    for result in results:
+        if result['状态'] != PASSED:
+            app_logger.warning(f"{result['文件名']} 校验{result['状态']}：{[issue['说明'] for issue in result['问题']]}")
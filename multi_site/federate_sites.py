@@ -0,0 +1,163 @@
+# encoding=utf-8
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from config import site_directory_paths, daily_series_store_path, export_path, app_logger, error_logger
+from extract_data.daily_series_store import build_daily_series_store
+from extract_data.extract_sales_data import extract_sales_data
+from ledger_validation.validate_ledgers import refresh_quarantined_files
+from shortage_rate.calculate_shortage_rate import calculate_shortage_rate
+from upper_and_lower_limits.calculate_upper_and_lower_limits import analyze_sales_data
+from utils import list_excel_files
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+ROLLUP_SITE = '全院'
+
+
+def site_store_path(site):
+    """各站点使用独立的共享存储目录（与默认存储同级），一个站点刷新不影响其他站点"""
+    return f'{daily_series_store_path}_{site}'
+
+
+def analyze_drug(sales_info, start_date=None, end_date=None):
+    """对单个药品计算拟设上下限及短缺率"""
+    result = analyze_sales_data(sales_info, start_date, end_date, export_graph=False)
+    if result is None:
+        return None
+
+    shortage_rate = calculate_shortage_rate(sales_info['销量数据'].copy(), start_date, end_date)
+    if shortage_rate is not None:
+        result.update({key: shortage_rate[key] for key in ['短缺天数', '在售天数', '短缺率']})
+    result['站点'] = sales_info.get('站点')
+    return result
+
+
+def process_site_file(site, file_path, start_date=None, end_date=None):
+    """
+    提取并分析单个站点的单个文件（在子进程中执行）
+    :return: (带站点标记的销量信息, 分析结果)，失败时为(None, None)
+    """
+    try:
+        sales_info = extract_sales_data(file_path)
+        if sales_info is None:
+            return None, None
+        sales_info['站点'] = site
+        return sales_info, analyze_drug(sales_info, start_date, end_date)
+    except Exception as e:
+        error_logger.error(f"处理站点 {site} 的文件 {file_path} 时发生错误: {e}")
+        return None, None
+
+
+def ingest_sites(sites=None, start_date=None, end_date=None, max_workers=None):
+    """
+    并行提取、分析各站点的出入库明细，并刷新各站点的共享存储
+    :param sites: {站点名称: 目录}，为空时使用config.site_directory_paths
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param max_workers: 最大进程数
+    :return: ({站点名称: 销量信息列表}, 各站点分析结果)
+    """
+    sites = sites or site_directory_paths
+    sales_data = {site: [] for site in sites}
+    results = []
+
+    # 跳过账目校验未通过的文件，未校验过或有变化的文件先重新校验
+    quarantined_files = {site: refresh_quarantined_files(directory, max_workers=max_workers)
+                         for site, directory in sites.items()}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_site_file, site, os.path.join(directory, filename), start_date, end_date)
+                   for site, directory in sites.items() for filename in list_excel_files(directory)
+                   if filename not in quarantined_files[site]]
+        for future in as_completed(futures):
+            sales_info, result = future.result()
+            if sales_info is not None:
+                sales_data[sales_info['站点']].append(sales_info)
+            if result is not None:
+                results.append(result)
+
+    for site, site_sales_data in sales_data.items():
+        site_sales_data.sort(key=lambda info: info['文件名'])
+        build_daily_series_store(site_sales_data, site_store_path(site))
+        app_logger.info(f"站点 {site} 提取完成，共 {len(site_sales_data)} 个药品")
+
+    return sales_data, pd.DataFrame.from_records(results)
+
+
+def combine_site_sales(sales_infos):
+    """
+    将同一自定义码在各站点的日销量数据合并为全院数据（销量、日结库存按日相加）
+    各站点只在其自身明细覆盖的日期内计入销量和库存，覆盖范围之外按0计，不沿用最后一日的结余，
+    以免已不再持有的库存掩盖其他站点的短缺
+    :param sales_infos: 同一药品在各站点的销量信息
+    :return: 全院销量信息
+    """
+    frames = []
+    for sales_info in sales_infos:
+        sales_df = sales_info['销量数据'][['操作日期', '当日销量', '日结库存']].copy()
+        sales_df['日结库存'] = sales_df['日结库存'].fillna(0)
+        frames.append(sales_df.set_index('操作日期'))
+
+    combined = pd.concat(frames, axis=1, keys=range(len(frames)))
+    # 各站点覆盖范围之间的空档同样计入全院日历（按0计），以免空档中的短缺被跳过
+    calendar = pd.date_range(min(combined.index), max(combined.index)).date
+    combined = combined.reindex(calendar)
+    # 覆盖范围内的日结库存已在merge_and_fillna中按前一日结余填充，范围之外的销量、库存均按0计
+    sales = combined.xs('当日销量', axis=1, level=1).fillna(0).sum(axis=1)
+    stock = combined.xs('日结库存', axis=1, level=1).fillna(0).sum(axis=1)
+    sales_df = pd.DataFrame({'操作日期': combined.index, '当日销量': sales.values, '日结库存': stock.values})
+
+    first_info = sales_infos[0]
+    return {'文件名': '+'.join(f"{info['站点']}:{info['文件名']}" for info in sales_infos),
+            '药品基本信息': first_info['药品基本信息'],
+            '销量数据': sales_df,
+            '站点': ROLLUP_SITE}
+
+
+def rollup_sites(sales_data, start_date=None, end_date=None, max_workers=None):
+    """
+    按自定义码汇总各站点数据，并行计算全院拟设上下限及短缺率
+    :param sales_data: {站点名称: 销量信息列表}
+    :return: 全院分析结果
+    """
+    drugs = {}
+    for site_sales_data in sales_data.values():
+        for sales_info in site_sales_data:
+            drugs.setdefault(str(sales_info['药品基本信息']['自定义码']), []).append(sales_info)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(analyze_drug, combine_site_sales(sales_infos), start_date, end_date): drug_code
+                   for drug_code, sales_infos in drugs.items()}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                if result is not None:
+                    result['站点数'] = len(drugs[futures[future]])
+                    results.append(result)
+            except Exception as e:
+                error_logger.error(f"汇总自定义码 {futures[future]} 时发生错误: {e}")
+
+    return pd.DataFrame.from_records(results)
+
+
+if __name__ == '__main__':
+    start_date = None
+    end_date = None
+
+    sales_data, site_results = ingest_sites(start_date=start_date, end_date=end_date)
+    app_logger.info(f"各站点提取、分析完成！")
+    rollup_results = rollup_sites(sales_data, start_date, end_date)
+    app_logger.info(f"全院汇总完成！")
+
+    # 导出结果到Excel文件
+    os.makedirs(export_path, exist_ok=True)
+    export_xls_file = os.path.join(export_path, "多站点分析结果.xlsx")
+    with pd.ExcelWriter(export_xls_file) as writer:
+        site_results.sort_values(['站点', '文件名']).to_excel(writer, sheet_name='各站点', index=False)
+        rollup_results.sort_values('自定义码').to_excel(writer, sheet_name='全院汇总', index=False)
+    app_logger.info(f"导出结果到: {export_xls_file}")
@@ -0,0 +1,281 @@
+# encoding=utf-8
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from config import directory_path, golden_path, app_logger, error_logger
+from extract_data.daily_series_store import build_daily_series_store, open_daily_series_store, load_sales_info
+from extract_data.extract_sales_data import extract_sales_data, extract_sales_data_from_df
+from extract_data.sales_cube import build_sales_cube, query_sales_cube
+from shortage_rate.calculate_shortage_rate import calculate_shortage_rate
+from turnover.calculate_turnover_rate import calculate_turnover_metrics
+from upper_and_lower_limits.calculate_upper_and_lower_limits import analyze_sales_data
+from utils import list_excel_files
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+# 需要校验的指标，直接影响请领决策
+LIMIT_METRICS = ['拟设下限', '拟设上限', '10日销售额P95', '销量价值等级', '销量波动', '库存天数', '日均销量', '0销量天数占比']
+SHORTAGE_METRICS = ['短缺天数', '在售天数', '短缺率']
+METRICS = LIMIT_METRICS + SHORTAGE_METRICS
+
+
+def generate_synthetic_ledger(seed, days=240, start_date=None):
+    """
+    生成确定性的模拟出入库明细，列与HIS导出的药品出入库明细一致
+    :param seed: 随机种子
+    :param days: 天数
+    :param start_date: 起始日期，为空时各药品从2023-03-01起错开若干天，使日期区间的截取各不相同
+    :return: 出入库明细
+    """
+    rng = np.random.default_rng(seed)
+    start_date = start_date or pd.Timestamp('2023-03-01') + pd.Timedelta(days=seed * 7 % 60)
+    price = round(float(rng.uniform(0.5, 800)), 2)
+    mean_sales = float(rng.uniform(0.2, 60))
+    reorder_point = mean_sales * rng.uniform(2, 8)
+    stock = int(mean_sales * 10) + 1
+
+    records = []
+    for day in pd.date_range(start=start_date, periods=days, freq='D'):
+        # 库存低于请领点时入库
+        if stock < reorder_point and rng.random() < 0.7:
+            quantity = int(mean_sales * rng.uniform(5, 15)) + 1
+            stock += quantity
+            records.append(('入库', quantity, stock, day + pd.Timedelta(hours=9)))
+
+        # 住院摆药，一天分若干批次，且不能超过现有库存
+        for batch in range(int(rng.integers(0, 4))):
+            quantity = min(int(rng.poisson(mean_sales / 2)), stock)
+            if quantity == 0:
+                continue
+            stock -= quantity
+            records.append(('住院摆药', -quantity, stock, day + pd.Timedelta(hours=10 + batch)))
+
+        # 偶发退药
+        if rng.random() < 0.05:
+            quantity = int(rng.integers(1, 3))
+            stock += quantity
+            records.append(('住院摆药', quantity, stock, day + pd.Timedelta(hours=16)))
+
+    df = pd.DataFrame(records, columns=['类型', '入出库数量', '库存量', '操作日期'])
+    df['自定义码'] = f'SYN{seed:04d}'
+    df['药品名称'] = f'模拟药品{seed}'
+    df['规格'] = f'{seed}mg'
+    df['单位'] = '支'
+    df['购入金额'] = (df['入出库数量'] * price).round(2)
+    return df
+
+
+def load_synthetic_sales_data(count=20, seeds_offset=0):
+    """生成一组模拟药品的销量数据"""
+    sales_data = []
+    for seed in range(seeds_offset, seeds_offset + count):
+        result = extract_sales_data_from_df(generate_synthetic_ledger(seed), f'synthetic_{seed}.xls')
+        if result:
+            sales_data.append(result)
+    return sales_data
+
+
+def load_sample_sales_data(directory=directory_path):
+    """提取样例目录中所有药品的销量数据"""
+    sales_data = []
+    for filename in list_excel_files(directory):
+        try:
+            result = extract_sales_data(os.path.join(directory, filename))
+            if result:
+                sales_data.append(result)
+        except Exception as e:
+            error_logger.error(f"处理文件 {filename} 时发生错误: {e}")
+    return sales_data
+
+
+def analyze_metrics(sales_info, start_date=None, end_date=None):
+    """对单个药品执行上下限与短缺率分析，返回需要校验的指标"""
+    limits = analyze_sales_data(sales_info, start_date, end_date, export_graph=False)
+    shortage = calculate_shortage_rate(sales_info['销量数据'].copy(), start_date, end_date)
+    if limits is None or shortage is None:
+        return None
+
+    result = {'文件名': sales_info['文件名']}
+    result.update({metric: limits[metric] for metric in LIMIT_METRICS})
+    result.update({metric: shortage[metric] for metric in SHORTAGE_METRICS})
+    return result
+
+
+def reference_engine(sales_data, start_date=None, end_date=None):
+    """基准模式：逐个药品调用现有的分析流程"""
+    results = [analyze_metrics(sales_info, start_date, end_date) for sales_info in sales_data]
+    return pd.DataFrame.from_records([result for result in results if result])
+
+
+def daily_series_store_engine(sales_data, start_date=None, end_date=None):
+    """共享存储模式：销量数据经内存映射存储往返后再分析"""
+    with tempfile.TemporaryDirectory() as store_path:
+        build_daily_series_store(sales_data, store_path)
+        store = open_daily_series_store(store_path)
+        restored = [load_sales_info(store, row) for row in range(len(store['药品索引']))]
+        del store
+    return reference_engine(restored, start_date, end_date)
+
+
+def sales_cube_engine(sales_data, start_date=None, end_date=None):
+    """前缀和模式：由前缀和直接查询区间指标，仅校验可由前缀和得到的指标"""
+    with tempfile.TemporaryDirectory() as store_path:
+        build_daily_series_store(sales_data, store_path)
+        store = open_daily_series_store(store_path)
+        report = query_sales_cube(build_sales_cube(store), start_date, end_date)
+        # 与filter_date_range一致，区间内没有数据的药品不输出结果
+        report = report[report['统计天数'] > 0]
+        file_names = [record['文件名'] for record in store['药品索引']]
+        del store
+
+    return pd.DataFrame({
+        '文件名': [file_names[row] for row in report['行号']],
+        '销量波动': report['相对标准差'].round(2),
+        '库存天数': report['库存天数'].round(2),
+        '日均销量': report['日均销量'].round(2),
+        '0销量天数占比': report['0销量天数占比'],
+        '短缺天数': report['短缺天数'],
+        '在售天数': report['在售天数'],
+        '短缺率': report['短缺率'],
+    })
+
+
+# 可供校验的执行模式，新增模式时在此注册
+ENGINES = {
+    'reference': reference_engine,
+    'daily_series_store': daily_series_store_engine,
+    'sales_cube': sales_cube_engine,
+}
+
+
+def save_golden(results, name, path=golden_path):
+    """保存基准结果"""
+    os.makedirs(path, exist_ok=True)
+    golden_file = os.path.join(path, f'{name}.csv')
+    results.sort_values('文件名').to_csv(golden_file, index=False, float_format='%.17g', encoding='utf-8-sig')
+    app_logger.info(f"基准结果已保存到 {golden_file}")
+    return golden_file
+
+
+def load_golden(name, path=golden_path):
+    """读取基准结果"""
+    return pd.read_csv(os.path.join(path, f'{name}.csv'), encoding='utf-8-sig')
+
+
+def compare_results(golden, results, rtol=1e-9, atol=1e-9):
+    """
+    逐药品、逐指标比较结果
+    :param golden: 基准结果
+    :param results: 待校验结果
+    :param rtol: 相对容差
+    :param atol: 绝对容差
+    :return: 差异明细，无差异时为空表
+    """
+    merged = pd.merge(golden, results, on='文件名', how='outer', suffixes=('_基准', '_当前'), indicator=True)
+    diffs = []
+
+    # 药品缺失或多出
+    for _, row in merged[merged['_merge'] != 'both'].iterrows():
+        diffs.append({'文件名': row['文件名'], '指标': '药品',
+                      '基准值': row['_merge'] != 'right_only', '当前值': row['_merge'] != 'left_only', '差值': None})
+
+    # 只比较待校验结果中提供的指标
+    both = merged[merged['_merge'] == 'both']
+    for metric in [metric for metric in METRICS if metric in results.columns]:
+        expected = both[f'{metric}_基准'].astype(float).to_numpy()
+        actual = both[f'{metric}_当前'].astype(float).to_numpy()
+        # inf、nan视为与自身相等
+        equal = np.isclose(expected, actual, rtol=rtol, atol=atol, equal_nan=True) | (expected == actual)
+        for index in np.flatnonzero(~equal):
+            diffs.append({'文件名': both['文件名'].iloc[index], '指标': metric,
+                          '基准值': expected[index], '当前值': actual[index], '差值': actual[index] - expected[index]})
+
+    return pd.DataFrame(diffs, columns=['文件名', '指标', '基准值', '当前值', '差值'])
+
+
+def golden_windows(sales_data):
+    """
+    基准结果覆盖的日期区间，由数据的整体起止日期确定，保证每次运行一致
+    包括全部数据、早于药品起始日期的区间、序列中间的区间、短区间及跨越结束日期的区间
+    :return: {区间名称: (开始日期, 结束日期)}
+    """
+    first_date = min(info['销量数据']['操作日期'].min() for info in sales_data)
+    last_date = max(info['销量数据']['操作日期'].max() for info in sales_data)
+
+    def window(start, end):
+        return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+    return {
+        '全部': (None, None),
+        '起始前': window(first_date - pd.Timedelta(days=30), first_date + pd.Timedelta(days=60)),
+        '区间内': window(first_date + pd.Timedelta(days=60), first_date + pd.Timedelta(days=120)),
+        '短区间': window(first_date + pd.Timedelta(days=90), first_date + pd.Timedelta(days=92)),
+        '跨结束': window(last_date - pd.Timedelta(days=45), last_date + pd.Timedelta(days=30)),
+    }
+
+
+def check_engine(engine_name, sales_data, golden_name, start_date=None, end_date=None, rtol=1e-9, atol=1e-9):
+    """用指定执行模式计算结果并与基准比较，返回差异明细"""
+    results = ENGINES[engine_name](sales_data, start_date, end_date)
+    diffs = compare_results(load_golden(golden_name), results, rtol=rtol, atol=atol)
+    if diffs.empty:
+        app_logger.info(f"执行模式 {engine_name} 与基准 {golden_name} 一致")
+    else:
+        error_logger.error(f"执行模式 {engine_name} 与基准 {golden_name} 不一致，差异如下：\n{diffs}")
+    return diffs
+
+
+def check_dead_stock_detection(dead_stock_days=90):
+    """
+    呆滞库存检查：一个药品持续销售，另一个药品60天后停止摆药但仍有库存，后者应被判定为呆滞库存
+    :return: 是否通过
+    """
+    active = generate_synthetic_ledger(1, start_date='2023-03-01')
+    stopped = generate_synthetic_ledger(2, start_date='2023-03-01')
+    stopped = stopped[stopped['操作日期'] < pd.Timestamp('2023-03-01') + pd.Timedelta(days=60)].copy()
+    # 停止摆药前补一笔入库，保证仍有库存
+    restock = stopped.iloc[[-1]].copy()
+    restock[['类型', '入出库数量']] = ['入库', 100]
+    restock['库存量'] = stopped['库存量'].iloc[-1] + 100
+    stopped = pd.concat([stopped, restock], ignore_index=True)
+
+    sales_data = [extract_sales_data_from_df(active, 'active.xls'), extract_sales_data_from_df(stopped, 'stopped.xls')]
+    with tempfile.TemporaryDirectory() as store_path:
+        build_daily_series_store(sales_data, store_path)
+        store = open_daily_series_store(store_path)
+        results = calculate_turnover_metrics(store, dead_stock_days=dead_stock_days).set_index('文件名')
+        del store
+
+    passed = bool(results.loc['stopped.xls', '呆滞库存']) and not results.loc['active.xls', '呆滞库存']
+    if passed:
+        app_logger.info("呆滞库存检查通过")
+    else:
+        error_logger.error(f"呆滞库存检查未通过：\n{results[['当前库存', '距上次销售天数', '呆滞库存']]}")
+    return passed
+
+
+if __name__ == '__main__':
+    # 用法：python check_result_equivalence.py save|check [synthetic|sample]
+    action = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    dataset = sys.argv[2] if len(sys.argv) > 2 else 'synthetic'
+
+    sales_data = load_synthetic_sales_data() if dataset == 'synthetic' else load_sample_sales_data()
+
+    # 每个日期区间保存一份基准结果，并分别比较
+    failed = False
+    for window_name, (start_date, end_date) in golden_windows(sales_data).items():
+        golden_name = f'{dataset}_{window_name}'
+        if action == 'save':
+            save_golden(reference_engine(sales_data, start_date, end_date), golden_name)
+            continue
+        for engine_name in ENGINES:
+            diffs = check_engine(engine_name, sales_data, golden_name, start_date, end_date)
+            failed = failed or not diffs.empty
+    if action != 'save':
+        failed = not check_dead_stock_detection() or failed
+    sys.exit(1 if failed else 0)
@@ -7,6 +7,7 @@ import matplotlib.dates as mdates
 
 from config import directory_path, export_path, app_logger, error_logger
 from extract_data.extract_sales_data import extract_sales_data
+from ledger_validation.validate_ledgers import refresh_quarantined_files
 from utils import filter_date_range
 
 pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
@@ -20,7 +21,7 @@ def calculate_shortage_rate(sales_df, start_date=None, end_date=None):  # start_
 
     # 检查筛选后的数据是否为空
     if filtered_df.empty:
-        app_logger.warning(f"文件 {file_name} 中没有在 {start_date} 到 {end_date} 之间的数据")
+        app_logger.warning(f"销量数据中没有在 {start_date} 到 {end_date} 之间的数据")
         return None
 
     # df新增两列：是否短缺（日结库存<当日销量）、是否在售（当日销量不为0或者日结库存不为0）
@@ -93,8 +94,14 @@ if __name__ == '__main__':
     except ValueError:
         sorted_excel_files = sorted(excel_files, key=lambda x: str(x.split('.')[0]))
 
+    # 跳过账目校验未通过的文件，未校验过或有变化的文件先重新校验
+    quarantined_files = refresh_quarantined_files(directory_path, sorted_excel_files)
+
     # 遍历所有Excel文件，计算短缺率
     for file_name in sorted_excel_files:
+        if file_name in quarantined_files:
+            app_logger.warning(f"文件 {file_name} 未通过账目校验，已跳过")
+            continue
         file_path = os.path.join(directory_path, file_name)
         result = process_file(file_path, start_date, end_date)
         if result:
@@ -0,0 +1,127 @@
+# encoding=utf-8
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import daily_series_store_path, export_path, app_logger
+from extract_data.daily_series_store import open_daily_series_store
+from utils import parse_date
+
+pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
+pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
+
+
+def rolling_sum(matrix, window):
+    """按行计算滚动求和（NaN按0计），与pandas rolling(window, min_periods=1).sum()一致"""
+    cumsum = np.cumsum(np.nan_to_num(matrix), axis=1)
+    result = cumsum.copy()
+    result[:, window:] -= cumsum[:, :-window]
+    return result
+
+
+def rolling_count(matrix, window):
+    """按行统计滚动窗口内的有效（非NaN）天数"""
+    return rolling_sum((~np.isnan(matrix)).astype(np.float64), window)
+
+
+def safe_divide(numerator, denominator):
+    """分母为0时返回NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator != 0, numerator / denominator, np.nan)
+
+
+def calculate_turnover_metrics(store, start_date=None, end_date=None, window=30, dead_stock_days=90):
+    """
+    对共享存储中的全部药品批量计算周转指标
+    :param store: open_daily_series_store的返回值
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param window: 滚动周转率的窗口天数
+    :param dead_stock_days: 连续无销量且有库存达到该天数时判定为呆滞库存
+    :return: 周转指标表，每行一个药品
+    """
+    dates = store['日期']
+    start = np.datetime64(parse_date(start_date), 'D') if start_date else dates[0]
+    end = np.datetime64(parse_date(end_date), 'D') if end_date else dates[-1]
+    columns = (dates >= start) & (dates <= end)
+    dates = dates[columns]
+    if len(dates) == 0:
+        app_logger.warning(f"共享存储中没有 {start_date} 到 {end_date} 之间的数据")
+        return pd.DataFrame()
+    sales = np.asarray(store['当日销量'][:, columns])
+    stock = np.asarray(store['日结库存'][:, columns])
+
+    drug_index = pd.DataFrame(store['药品索引'])
+    price = np.abs(safe_divide(drug_index['购入金额'].to_numpy(dtype=np.float64),
+                               drug_index['入出库数量'].to_numpy(dtype=np.float64)))
+
+    # 各药品在窗口内的有效天数及第一个、最后一个有效日（即各药品实际覆盖的日期）
+    valid = ~np.isnan(sales)
+    valid_days = valid.sum(axis=1)
+    rows = np.arange(sales.shape[0])
+    first_column = np.where(valid_days > 0, np.argmax(valid, axis=1), 0)
+    last_column = np.where(valid_days > 0, sales.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1), 0)
+
+    # 期间周转率 = 期间销量 / 日均库存；库存天数 = 日均库存 / 日均销量
+    total_sales = np.nansum(sales, axis=1)
+    daily_avg_sales = safe_divide(total_sales, valid_days)
+    daily_avg_stock = safe_divide(np.nansum(stock, axis=1), (~np.isnan(stock)).sum(axis=1))
+    period_turnover = safe_divide(total_sales, daily_avg_stock)
+    days_of_stock = safe_divide(daily_avg_stock, daily_avg_sales)
+
+    # 近N日滚动周转率（取各药品最后一个有效日的值）及可供天数
+    window_sales = rolling_sum(sales, window)
+    window_avg_stock = safe_divide(rolling_sum(stock, window), rolling_count(stock, window))
+    rolling_turnover = safe_divide(window_sales, window_avg_stock)[rows, last_column]
+    recent_daily_sales = safe_divide(window_sales, rolling_count(sales, window))[rows, last_column]
+    last_stock = stock[rows, last_column]
+    days_of_supply = safe_divide(last_stock, recent_daily_sales)
+
+    # 距最后一次有销量的天数，超过阈值且仍有库存则为呆滞库存
+    # extract_sales_data的日历止于最后一次住院摆药，因此以查询区间的结束日而不是药品自身的最后有效日计算
+    has_sales = np.nan_to_num(sales) > 0
+    ever_sold = has_sales.any(axis=1)
+    window_end_column = sales.shape[1] - 1
+    last_sale_column = window_end_column - np.argmax(has_sales[:, ::-1], axis=1)
+    days_since_last_sale = np.where(ever_sold, window_end_column - last_sale_column,
+                                    window_end_column - first_column + 1)
+    dead_stock = (days_since_last_sale >= dead_stock_days) & (np.nan_to_num(last_stock) > 0)
+
+    result = pd.DataFrame({
+        '文件名': drug_index['文件名'],
+        '自定义码': drug_index['自定义码'],
+        '药品名称': drug_index['药品名称'],
+        '规格': drug_index['规格'],
+        '单位': drug_index['单位'],
+        '单价': price.round(4),
+        '日均销量': daily_avg_sales.round(2),
+        '日均库存': daily_avg_stock.round(2),
+        '期间周转率': period_turnover.round(2),
+        '库存天数': days_of_stock.round(2),
+        f'近{window}日周转率': rolling_turnover.round(2),
+        '当前库存': last_stock,
+        '可供天数': days_of_supply.round(2),
+        '库存金额': (np.nan_to_num(last_stock) * price).round(2),
+        '距上次销售天数': days_since_last_sale,
+        '呆滞库存': dead_stock,
+        '统计天数': valid_days,
+        '起始日期': pd.to_datetime(dates[first_column]).date,
+        '结束日期': pd.to_datetime(dates[last_column]).date,
+    })
+    return result[valid_days > 0].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    start_date = None
+    end_date = None
+
+    store = open_daily_series_store(daily_series_store_path)
+    results = calculate_turnover_metrics(store, start_date, end_date)
+    app_logger.info(f"周转分析完成，共 {len(results)} 个药品，其中呆滞库存 {int(results['呆滞库存'].sum())} 个")
+
+    # 按库存金额降序导出结果到Excel文件
+    os.makedirs(export_path, exist_ok=True)
+    export_xls_file = os.path.join(export_path, "周转分析结果.xlsx")
+    results.sort_values(['呆滞库存', '库存金额'], ascending=False).to_excel(export_xls_file, index=False)
+    app_logger.info(f"周转分析结果已导出到 {export_xls_file}")
@@ -1,18 +1,28 @@
+import hashlib
 import os
+import time
 from datetime import datetime
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
-from config import directory_path, export_path, app_logger, error_logger
-from extract_data.extract_sales_data import extract_sales_data
+from batch_charts.chart_template import prepare_chart_data, render_batch_report, value_level_text
+from config import directory_path, export_path, checkpoint_path, app_logger, error_logger
+from extract_data.extract_sales_data import extract_sales_data_from_df
+from ledger_validation.validate_ledgers import refresh_quarantined_files
+from utils import append_journal, file_signature, list_excel_files, load_journal, read_excel_file, report_progress
 
 pd.set_option('expand_frame_repr', False)  # 当列太多时显示不清楚
 pd.set_option('display.unicode.east_asian_width', True)  # 设置输出右对齐
 
+# 断点日志中的处理状态
+JOURNAL_DONE = '完成'
+JOURNAL_NO_DATA = '无数据'
+JOURNAL_FAILED = '失败'
 
-def analyze_sales_data(sales_info, start_date=None, end_date=None):  # start_date和end_date为空时，默认分析所有数据
+
+def analyze_sales_data(sales_info, start_date=None, end_date=None, export_graph=True):  # start_date和end_date为空时，默认分析所有数据
     file_name = sales_info.get('文件名')
     basic_info = sales_info.get('药品基本信息')
     sales_df = sales_info.get('销量数据')
@@ -58,12 +68,13 @@ def analyze_sales_data(sales_info, start_date=None, end_date=None):  # start_dat
                                                                                percentile_95_10=percentile_95_10,
                                                                                relative_std=relative_std,
                                                                                zero_sales_days_ratio=zero_sales_days_ratio)
-        # 画图
-        draw_a_graph(filtered_df, basic_info['药品名称'], basic_info['规格'], value_level=value_level,
-                     upper_limit=round(upper_limit, 2), lower_limit=round(lower_limit, 2))
+        if export_graph:
+            # 画图
+            draw_a_graph(filtered_df, basic_info['药品名称'], basic_info['规格'], value_level=value_level,
+                         upper_limit=round(upper_limit, 2), lower_limit=round(lower_limit, 2))
 
-        # 导出图片
-        export_img(file_name, basic_info['药品名称'], basic_info['规格'])
+            # 导出图片
+            export_img(file_name, basic_info['药品名称'], basic_info['规格'])
 
         return {'文件名': file_name,
                 '自定义码': basic_info['自定义码'],
@@ -162,20 +173,8 @@ def draw_a_graph(df, drug_name, unit, **kwargs):
     plt.text(df['操作日期'].iloc[-1], upper_limit * 1.05, f'拟设上限：{upper_limit:.2f}', ha='left', va='center')
 
     # 显示文字
-    if value_level == 1:
-        text = '10日销售额：极低值'
-    elif value_level == 2:
-        text = '10日销售额：低值'
-    elif value_level == 3:
-        text = '10日销售额：中等值'
-    elif value_level == 4:
-        text = '10日销售额：高值'
-    elif value_level == 5:
-        text = '10日销售额：极高值'
-    else:
-        text = '10日销售额：未知'
-
-    plt.text(df['操作日期'].iloc[-1], (upper_limit + lower_limit) / 2, text, ha='left', va='center')
+    plt.text(df['操作日期'].iloc[-1], (upper_limit + lower_limit) / 2, value_level_text(value_level),
+             ha='left', va='center')
 
     # 设置图表标题和坐标轴标签
     plt.title(f'{drug_name}库存与销量分析（单位：{unit}）')
@@ -212,39 +211,114 @@ def export_img(file_name, drug_name, drug_specifications):
     plt.savefig(export_img_file)
 
 
-if __name__ == '__main__':
-    # 获取所有文件
-    all_files = os.listdir(directory_path)
-    # 过滤出Excel文件
-    excel_files = [file for file in all_files if file.endswith(('.xlsx', '.xls'))]
-    # 按文件名中的数字部分排序
-    try:
-        sorted_excel_files = sorted(excel_files, key=lambda x: int(x.split('.')[0]))
-    except ValueError:
-        sorted_excel_files = sorted(excel_files, key=lambda x: str(x.split('.')[0]))
-
-    # 遍历所有Excel文件，提取销量数据
-    sales_data = []
-    for filename in sorted_excel_files:
-        file_path = os.path.join(directory_path, filename)
+def journal_file_path(directory, start_date=None, end_date=None):
+    """断点日志按目录（绝对路径）及日期范围区分，不同目录下的同名文件互不影响"""
+    directory = os.path.abspath(directory)
+    directory_key = hashlib.md5(directory.encode('utf-8')).hexdigest()[:8]
+    file_name = f"销量分析_{os.path.basename(directory)}_{directory_key}_{start_date or '全部'}_{end_date or '全部'}.jsonl"
+    return os.path.join(checkpoint_path, file_name)
+
+
+def chart_data_path(journal_file, file_name):
+    """图表数据保存在断点日志同名目录下，重新运行时已完成药品的图表无需重新读取明细"""
+    return os.path.join(os.path.splitext(journal_file)[0], f'{file_name}.pkl')
+
+
+def save_chart_data(journal_file, file_name, chart_df):
+    """先写临时文件再替换，中断时不会留下写了一半的图表数据"""
+    chart_file = chart_data_path(journal_file, file_name)
+    os.makedirs(os.path.dirname(chart_file), exist_ok=True)
+    temp_file = f'{chart_file}.tmp{os.getpid()}'
+    chart_df.to_pickle(temp_file)
+    os.replace(temp_file, chart_file)
+
+
+def iter_chart_data(journal_file, results):
+    """按结果顺序逐个读取图表数据，供render_batch_report流式绘图"""
+    for result in results:
+        chart_file = chart_data_path(journal_file, result['文件名'])
+        if not os.path.exists(chart_file):
+            app_logger.warning(f"文件 {result['文件名']} 的图表数据不存在，已跳过")
+            continue
+        yield pd.read_pickle(chart_file), result
+
+
+def run_batch_analysis(directory, start_date=None, end_date=None, journal_file=None):
+    """
+    逐个药品流式执行 提取 → 分析 → 写入断点日志，中断后重新运行会跳过已完成的药品
+    :param directory: 出入库明细目录
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param journal_file: 断点日志文件，为空时按目录及日期范围自动命名
+    :return: 全部药品的分析结果（包括之前运行完成的），各药品的图表数据可通过iter_chart_data读取
+    """
+    journal_file = journal_file or journal_file_path(directory, start_date, end_date)
+
+    # 跳过账目校验未通过的文件（未校验过或有变化的文件先重新校验），
+    # 以及断点日志中已完成且文件未变化的文件（失败或有变化的文件重新处理）
+    quarantined_files = refresh_quarantined_files(directory)
+    excel_files = [filename for filename in list_excel_files(directory) if filename not in quarantined_files]
+    signatures = {filename: file_signature(os.path.join(directory, filename)) for filename in excel_files}
+    journal = load_journal(journal_file)
+
+    def is_finished(filename, statuses):
+        record = journal.get(filename, {})
+        return record.get('状态') in statuses and record.get('文件签名') == signatures[filename]
+
+    # 已完成但图表数据丢失的文件同样重新处理
+    pending_files = [filename for filename in excel_files
+                     if not (is_finished(filename, (JOURNAL_NO_DATA,)) or
+                             (is_finished(filename, (JOURNAL_DONE,)) and
+                              os.path.exists(chart_data_path(journal_file, filename))))]
+    app_logger.info(f"共 {len(excel_files)} 个文件，断点日志中已完成 {len(excel_files) - len(pending_files)} 个")
+
+    started_at = time.time()
+    for done, filename in enumerate(pending_files, start=1):
+        result = None
         try:
-            result = extract_sales_data(file_path)
-            if result:
-                sales_data.append(result)
+            # 读取失败（如文件被Excel占用）记为失败以便重试，只有确实没有住院摆药记录时才记为无数据
+            df = read_excel_file(os.path.join(directory, filename))
+            if df is None:
+                status = JOURNAL_FAILED
+            else:
+                sales_info = extract_sales_data_from_df(df, filename)
+                if sales_info:
+                    result = analyze_sales_data(sales_info, start_date, end_date, export_graph=False)
+                if result:
+                    # 图表数据先于断点记录写入，记录为完成的药品一定有对应的图表数据
+                    save_chart_data(journal_file, filename, prepare_chart_data(sales_info, result))
+                status = JOURNAL_DONE if result else JOURNAL_NO_DATA
         except Exception as e:
             error_logger.error(f"处理文件 {filename} 时发生错误: {e}")
-    app_logger.info(f"提取销量数据，完成！")
-
-    # 分析销量数据并导出结果
-    results = []
-    for sale_info in sales_data:
-        result = analyze_sales_data(sale_info, '2023-04-01', '2023-11-30')
-        if result:
-            results.append(result)
+            result = None
+            status = JOURNAL_FAILED
+        append_journal(journal_file, filename, status, result, signatures[filename])
+        report_progress(done, len(pending_files), started_at, filename)
+
+    # 按文件顺序汇总断点日志中全部已完成的结果（包括之前运行完成的）
+    journal = load_journal(journal_file)
+    results = [journal[filename]['结果'] for filename in excel_files if is_finished(filename, (JOURNAL_DONE,))]
+    failed_files = [filename for filename in excel_files if journal.get(filename, {}).get('状态') == JOURNAL_FAILED]
+    if failed_files:
+        app_logger.warning(f"以下文件处理失败，重新运行时将重试: {failed_files}")
+    return results
+
+
+if __name__ == '__main__':
+    start_date = '2023-04-01'
+    end_date = '2023-11-30'
+    journal_file = journal_file_path(directory_path, start_date, end_date)
+    results = run_batch_analysis(directory_path, start_date, end_date, journal_file)
     app_logger.info(f"分析销量数据，完成！")
 
-    # 将数据列表转换为DataFrame
+    # 复用同一图表模板逐页绘图，导出为一个多页PDF报告（包括之前运行完成的药品）
+    render_batch_report(iter_chart_data(journal_file, results), os.path.join(export_path, "销量分析图表.pdf"))
+
+    # 将数据列表转换为DataFrame，断点日志中的日期为字符串，转换回日期格式
     df = pd.DataFrame.from_records(results)
+    if not df.empty:
+        df['起始日期'] = pd.to_datetime(df['起始日期']).dt.date
+        df['结束日期'] = pd.to_datetime(df['结束日期']).dt.date
     # 导出结果到Excel文件
     os.makedirs(export_path, exist_ok=True)
     export_xls_file = os.path.join(export_path, "销量分析结果.xlsx")
@@ -1,5 +1,7 @@
+import json
 import os
-from datetime import datetime
+import time
+from datetime import date, datetime
 
 import pandas as pd
 
@@ -49,6 +51,15 @@ def continue_read_excel_file(file_path, df, max_rows):
     return df
 
 
+def list_excel_files(directory):
+    """获取目录下所有Excel文件,剔除文件名中包含下划线"_"的文件（因行数达到.xls文件上限而分割的文件），并按文件名中的数字部分排序"""
+    excel_files = [file for file in os.listdir(directory) if file.endswith(('.xlsx', '.xls')) and '_' not in file]
+    try:
+        return sorted(excel_files, key=lambda x: int(x.split('.')[0]))
+    except ValueError:
+        return sorted(excel_files, key=lambda x: str(x.split('.')[0]))
+
+
 def parse_date(date_str):
     """解析日期字符串，如果为空则返回None"""
     return datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
@@ -59,3 +70,69 @@ def filter_date_range(df, start_date, end_date):
     start_date = max(parse_date(start_date) or df['操作日期'].min(), df['操作日期'].min())
     end_date = min(parse_date(end_date) or df['操作日期'].max(), df['操作日期'].max())
     return df[(df['操作日期'] >= start_date) & (df['操作日期'] <= end_date)], start_date, end_date
+
+
+def _to_json_value(value):
+    """将日期、numpy标量转换为可JSON序列化的对象"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def load_journal(journal_file):
+    """
+    读取断点续跑日志，每行一个JSON记录，以文件名为键，后写入的记录覆盖先写入的记录
+    中断时最后一行可能不完整，直接忽略
+    """
+    journal = {}
+    if not os.path.exists(journal_file):
+        return journal
+    with open(journal_file, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                app_logger.warning(f"断点日志 {journal_file} 存在不完整的记录，已忽略")
+                continue
+            journal[record['文件名']] = record
+    return journal
+
+
+def file_signature(file_path):
+    """文件及其续读文件（如155_1.xls）的修改时间和大小，任一变化即说明需要重新处理"""
+    directory = os.path.dirname(file_path)
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    file_names = [os.path.basename(file_path)] + sorted(
+        file for file in os.listdir(directory or '.') if file.startswith(f'{base_name}_') and file.endswith('.xls'))
+    signature = []
+    for file_name in file_names:
+        stat = os.stat(os.path.join(directory, file_name))
+        signature.append([file_name, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def append_journal(journal_file, file_name, status, result=None, signature=None):
+    """追加一条断点记录，并立即写入磁盘"""
+    os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+    record = {'文件名': file_name, '状态': status, '结果': result, '文件签名': signature}
+    line = json.dumps(record, ensure_ascii=False, default=_to_json_value) + '\n'
+    # 上次运行中断时最后一行可能没有换行符，先补上换行，避免新记录与不完整的记录连成一行
+    if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+        with open(journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+    with open(journal_file, 'a', encoding='utf-8') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def report_progress(done, total, started_at, file_name=''):
+    """输出进度、处理速度及预计剩余时间"""
+    elapsed = time.time() - started_at
+    speed = done / elapsed if elapsed > 0 else 0
+    remaining = (total - done) / speed if speed > 0 else 0
+    app_logger.info(f"进度 {done}/{total}（{done / total:.1%}），{speed:.2f}个/秒，预计剩余{remaining:.0f}秒 {file_name}")